@@ -4,8 +4,12 @@ Environment variables:
 - BOT_TOKEN: required bot token.
 - ADMIN_USER_ID: Telegram ID of the admin (defaults to @askeditme ID constant).
 - DB_PATH: path to SQLite database file (defaults to "projects.db").
+- USE_WEBHOOK: set to "1"/"true" to receive updates via webhook instead of long polling.
+- PUBLIC_URL: public HTTPS base URL of the service; required when USE_WEBHOOK is set.
+- PORT: port for the webhook server to listen on (defaults to 8080).
 """
 from dataclasses import dataclass
+from typing import Optional
 import os
 
 ASKEDITME_TELEGRAM_ID = 205386594
@@ -16,6 +20,9 @@ class Config:
     bot_token: str
     admin_user_id: int
     db_path: str
+    use_webhook: bool = False
+    public_url: Optional[str] = None
+    port: int = 8080
 
 
 def load_config() -> Config:
@@ -31,4 +38,22 @@ def load_config() -> Config:
 
     db_path = os.getenv("DB_PATH", "projects.db")
 
-    return Config(bot_token=token, admin_user_id=admin_id, db_path=db_path)
+    use_webhook = os.getenv("USE_WEBHOOK", "").strip().lower() in ("1", "true", "yes")
+    public_url = os.getenv("PUBLIC_URL")
+    if use_webhook and not public_url:
+        raise ValueError("PUBLIC_URL is required when USE_WEBHOOK is enabled")
+
+    port_raw = os.getenv("PORT")
+    try:
+        port = int(port_raw) if port_raw else 8080
+    except ValueError as exc:
+        raise ValueError("PORT must be an integer") from exc
+
+    return Config(
+        bot_token=token,
+        admin_user_id=admin_id,
+        db_path=db_path,
+        use_webhook=use_webhook,
+        public_url=public_url.rstrip("/") if public_url else None,
+        port=port,
+    )
@@ -1,20 +1,26 @@
 """Telegram bot that relays messages between customer and executor chats.
 
-Run with long polling (recommended for Railway):
+Run with long polling (default) or a webhook:
 1. Set environment variables:
    - BOT_TOKEN: Telegram bot token.
    - ADMIN_USER_ID: Telegram ID of admin (owner Tanya / @askeditme). Optional if constant matches.
    - DB_PATH: (optional) path to SQLite DB file, defaults to projects.db.
+   - USE_WEBHOOK, PUBLIC_URL, PORT: (optional) enable webhook mode behind a public HTTPS URL
+     (Railway provides one and sets PORT).
 2. Install dependencies: `pip install -r requirements.txt`.
 3. Start the bot: `python main.py`.
 """
 from __future__ import annotations
 
+import asyncio
 import logging
-from typing import Optional
+from functools import partial
+from itertools import chain
+from typing import Dict, List, Optional, Tuple
 
-from telegram import Message, Update
+from telegram import Bot, Message, Update
 from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -24,41 +30,68 @@ from telegram.ext import (
 )
 
 from config import Config, load_config
-from storage import Project, SQLiteProjectRepository
+from storage import CACHE_MISS, Project, SQLiteProjectRepository
 
 logger = logging.getLogger(__name__)
 
+POLLING_TIMEOUT = 30
+
+# Text relays to the same chat arriving within this window are sent as one message.
+RELAY_BUFFER_DELAY = 0.5
+MAX_MESSAGE_LENGTH = 4096
+
+RELAY_FAILED_TEXT = "Не удалось отправить сообщение в парный чат. Проверьте настройки бота."
+
+# Only group messages of the kinds relay_message knows how to forward.
+RELAY_FILTER = (
+    filters.ChatType.GROUPS
+    & ~filters.COMMAND
+    & (
+        filters.TEXT
+        | filters.PHOTO
+        | filters.Document.ALL
+        | filters.VOICE
+        | filters.AUDIO
+        | filters.VIDEO
+    )
+)
+
 
 def is_admin(update: Update, config: Config) -> bool:
     user = update.effective_user
     return bool(user and user.id == config.admin_user_id)
 
 
-async def ensure_admin(update: Update, config: Config) -> bool:
+def ensure_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, config: Config) -> bool:
     if is_admin(update, config):
         return True
     if update.effective_message:
-        await update.effective_message.reply_text("Эта команда доступна только администратору.")
+        # Refuse without waiting on the reply round-trip.
+        context.application.create_task(
+            update.effective_message.reply_text("Эта команда доступна только администратору."),
+            update=update,
+        )
     return False
 
 
+PROJECT_STATUS_TEMPLATE = "{slug}: заказчик — {customer}, исполнители — {executor}, статус — {active}"
+
+
 def build_project_status(project: Project) -> str:
-    customer_status = (
-        f"привязан ({project.customer_chat_id})" if project.customer_chat_id else "не привязан"
-    )
-    executor_status = (
-        f"привязан ({project.executor_chat_id})" if project.executor_chat_id else "не привязан"
-    )
-    active_status = "активен" if project.is_active else "неактивен"
-    return (
-        f"{project.slug}: заказчик — {customer_status}, исполнители — {executor_status}, статус — {active_status}"
+    return PROJECT_STATUS_TEMPLATE.format_map(
+        {
+            "slug": project.slug,
+            "customer": f"привязан ({project.customer_chat_id})" if project.customer_chat_id else "не привязан",
+            "executor": f"привязан ({project.executor_chat_id})" if project.executor_chat_id else "не привязан",
+            "active": "активен" if project.is_active else "неактивен",
+        }
     )
 
 
 async def create_project_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE, config: Config, repo: SQLiteProjectRepository
 ) -> None:
-    if not await ensure_admin(update, config):
+    if not ensure_admin(update, context, config):
         return
     if not context.args:
         await update.effective_message.reply_text("Использование: /create_project <slug>")
@@ -66,7 +99,7 @@ async def create_project_handler(
     slug = context.args[0]
     chat_id = update.effective_chat.id
     try:
-        repo.create_project(slug, chat_id)
+        await asyncio.to_thread(repo.create_project, slug, chat_id)
     except ValueError as exc:
         await update.effective_message.reply_text(str(exc))
         return
@@ -78,7 +111,7 @@ async def create_project_handler(
 async def bind_customer_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE, config: Config, repo: SQLiteProjectRepository
 ) -> None:
-    if not await ensure_admin(update, config):
+    if not ensure_admin(update, context, config):
         return
     if not context.args:
         await update.effective_message.reply_text("Использование: /bind_customer <slug>")
@@ -86,7 +119,7 @@ async def bind_customer_handler(
     slug = context.args[0]
     chat_id = update.effective_chat.id
     try:
-        project = repo.bind_customer_chat(slug, chat_id)
+        project = await asyncio.to_thread(repo.bind_customer_chat, slug, chat_id)
     except ValueError as exc:
         await update.effective_message.reply_text(str(exc))
         return
@@ -99,7 +132,7 @@ async def project_info_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE, repo: SQLiteProjectRepository
 ) -> None:
     chat_id = update.effective_chat.id
-    found = repo.find_by_chat_id(chat_id)
+    found = await asyncio.to_thread(repo.find_by_chat_id, chat_id)
     if not found:
         await update.effective_message.reply_text("Этот чат не привязан ни к одному проекту.")
         return
@@ -113,22 +146,21 @@ async def project_info_handler(
 async def list_projects_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE, config: Config, repo: SQLiteProjectRepository
 ) -> None:
-    if not await ensure_admin(update, config):
+    if not ensure_admin(update, context, config):
         return
-    projects = repo.list_projects()
+    projects = await asyncio.to_thread(repo.list_projects)
     if not projects:
         await update.effective_message.reply_text("Проектов пока нет.")
         return
-    lines = ["Список проектов:"]
-    for project in projects:
-        lines.append(build_project_status(project))
-    await update.effective_message.reply_text("\n".join(lines))
+    await update.effective_message.reply_text(
+        "\n".join(chain(["Список проектов:"], (build_project_status(project) for project in projects)))
+    )
 
 
 async def unlink_project_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE, config: Config, repo: SQLiteProjectRepository
 ) -> None:
-    if not await ensure_admin(update, config):
+    if not ensure_admin(update, context, config):
         return
     if not context.args:
         await update.effective_message.reply_text("Использование: /unlink_project <slug>")
@@ -136,7 +168,7 @@ async def unlink_project_handler(
     slug = context.args[0]
     chat_id = update.effective_chat.id
     try:
-        project = repo.unlink_chat(slug, chat_id)
+        project = await asyncio.to_thread(repo.unlink_chat, slug, chat_id)
     except ValueError as exc:
         await update.effective_message.reply_text(str(exc))
         return
@@ -145,29 +177,127 @@ async def unlink_project_handler(
     )
 
 
-def caption_for_role(role: str) -> str:
-    return "🧑‍🎨 Сообщение от команды." if role == "executor" else "👤 Сообщение от клиента."
-
-
-def build_media_caption(role: str, original_caption: Optional[str]) -> str:
-    base = caption_for_role(role)
-    if original_caption:
-        return f"{base}\n{original_caption}"
-    return base
-
-
-def prefix_for_role(role: str) -> str:
-    return "🧑‍🎨 Сообщение от команды: " if role == "executor" else "👤 Сообщение от клиента: "
-
+ROLE_CAPTIONS = {
+    "executor": "🧑‍🎨 Сообщение от команды.",
+    "customer": "👤 Сообщение от клиента.",
+}
+ROLE_PREFIXES = {
+    "executor": "🧑‍🎨 Сообщение от команды: ",
+    "customer": "👤 Сообщение от клиента: ",
+}
+
+
+def split_for_telegram(entries: List[Tuple[str, Message]]) -> List[Tuple[str, Message]]:
+    """Join buffered texts with newlines into chunks of at most MAX_MESSAGE_LENGTH.
+
+    Each chunk is paired with the last source message it contains, which is
+    where a delivery error gets reported.
+    """
+    chunks: List[Tuple[str, Message]] = []
+    current = ""
+    current_message: Optional[Message] = None
+    for text, message in entries:
+        while len(text) > MAX_MESSAGE_LENGTH:
+            if current_message is not None:
+                chunks.append((current, current_message))
+                current, current_message = "", None
+            chunks.append((text[:MAX_MESSAGE_LENGTH], message))
+            text = text[MAX_MESSAGE_LENGTH:]
+        if current_message is not None and len(current) + 1 + len(text) <= MAX_MESSAGE_LENGTH:
+            current = f"{current}\n{text}"
+        else:
+            if current_message is not None:
+                chunks.append((current, current_message))
+            current = text
+        current_message = message
+    if current_message is not None:
+        chunks.append((current, current_message))
+    return chunks
+
+
+class RelayBuffer:
+    """Coalesces text relays per target chat into as few send_message calls as possible."""
+
+    def __init__(self, delay: float = RELAY_BUFFER_DELAY) -> None:
+        self.delay = delay
+        self._pending: Dict[int, List[Tuple[str, Message]]] = {}
+        # Scheduled flushes that are still waiting out the delay.
+        self._flush_tasks: Dict[int, asyncio.Task] = {}
+        # Serialises sends per target chat so relays keep their order.
+        self._send_locks: Dict[int, asyncio.Lock] = {}
+
+    def add(
+        self,
+        target_chat_id: int,
+        text: str,
+        message: Message,
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+    ) -> None:
+        self._pending.setdefault(target_chat_id, []).append((text, message))
+        if not context.application.running:
+            # stop() is draining the update queue and would not track a new task;
+            # the post_stop flush_all sends this text instead.
+            return
+        if target_chat_id not in self._flush_tasks:
+            # Created while running, so the application tracks it: errors reach
+            # on_error and stop() waits for it to finish.
+            self._flush_tasks[target_chat_id] = context.application.create_task(
+                self._flush_later(target_chat_id, context.bot), update=update
+            )
 
-async def relay_message(update: Update, context: ContextTypes.DEFAULT_TYPE, repo: SQLiteProjectRepository) -> None:
+    async def flush(self, target_chat_id: int, bot: Bot) -> None:
+        task = self._flush_tasks.pop(target_chat_id, None)
+        if task:
+            task.cancel()
+        await self._send(target_chat_id, bot)
+
+    async def flush_all(self, bot: Bot) -> None:
+        """Flush every chat with pending text concurrently; chunks within one chat stay ordered."""
+        target_chat_ids = list(self._pending)
+        results = await asyncio.gather(
+            *(self.flush(target_chat_id, bot) for target_chat_id in target_chat_ids),
+            return_exceptions=True,
+        )
+        for target_chat_id, result in zip(target_chat_ids, results):
+            if isinstance(result, Exception):
+                logger.error("Failed to flush buffered text to chat %s", target_chat_id, exc_info=result)
+
+    async def _flush_later(self, target_chat_id: int, bot: Bot) -> None:
+        await asyncio.sleep(self.delay)
+        self._flush_tasks.pop(target_chat_id, None)
+        await self._send(target_chat_id, bot)
+
+    async def _send(self, target_chat_id: int, bot: Bot) -> None:
+        lock = self._send_locks.setdefault(target_chat_id, asyncio.Lock())
+        async with lock:
+            entries = self._pending.pop(target_chat_id, [])
+            for text, message in split_for_telegram(entries):
+                try:
+                    await bot.send_message(target_chat_id, text)
+                except TelegramError as exc:
+                    logger.exception("Failed to relay buffered text to chat %s: %s", target_chat_id, exc)
+                    try:
+                        await message.reply_text(RELAY_FAILED_TEXT)
+                    except TelegramError:
+                        logger.exception("Failed to report relay failure in chat %s", message.chat_id)
+
+
+async def relay_message(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    repo: SQLiteProjectRepository,
+    buffer: RelayBuffer,
+) -> None:
     message: Optional[Message] = update.effective_message
     if not message:
         return
     if message.from_user and message.from_user.is_bot:
         return
     chat_id = message.chat_id
-    found = repo.find_by_chat_id(chat_id)
+    found = repo.cached_chat(chat_id)
+    if found is CACHE_MISS:
+        found = await asyncio.to_thread(repo.find_by_chat_id, chat_id)
     if not found:
         return
     project, role = found
@@ -176,13 +306,17 @@ async def relay_message(update: Update, context: ContextTypes.DEFAULT_TYPE, repo
         await message.reply_text("В проекте не привязан парный чат. Обратитесь к администратору.")
         return
 
-    caption = build_media_caption(role, message.caption)
-    text_prefix = prefix_for_role(role)
+    if message.text:
+        buffer.add(target_chat_id, f"{ROLE_PREFIXES[role]}{message.text}", message, update, context)
+        return
 
+    base_caption = ROLE_CAPTIONS[role]
+    caption = f"{base_caption}\n{message.caption}" if message.caption else base_caption
+
+    # Media goes out directly, after any text still buffered for the same chat.
+    await buffer.flush(target_chat_id, context.bot)
     try:
-        if message.text:
-            await context.bot.send_message(target_chat_id, f"{text_prefix}{message.text}")
-        elif message.document:
+        if message.document:
             await context.bot.send_document(
                 target_chat_id, message.document.file_id, caption=caption
             )
@@ -195,11 +329,9 @@ async def relay_message(update: Update, context: ContextTypes.DEFAULT_TYPE, repo
             await context.bot.send_audio(target_chat_id, message.audio.file_id, caption=caption)
         elif message.video:
             await context.bot.send_video(target_chat_id, message.video.file_id, caption=caption)
-        else:
-            await message.reply_text("Тип сообщения не поддерживается для пересылки.")
     except TelegramError as exc:
         logger.exception("Failed to relay message for project %s: %s", project.slug, exc)
-        await message.reply_text("Не удалось отправить сообщение в парный чат. Проверьте настройки бота.")
+        await message.reply_text(RELAY_FAILED_TEXT)
 
 
 async def help_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -215,39 +347,39 @@ async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 
 def build_application(config: Config, repo: SQLiteProjectRepository):
-    application = ApplicationBuilder().token(config.bot_token).build()
+    buffer = RelayBuffer()
+    application = (
+        ApplicationBuilder()
+        .token(config.bot_token)
+        # Keep-alive HTTP/2 pool for send_* calls, separate from the long-poll client
+        # so a pending getUpdates never holds a connection the relays need.
+        .request(HTTPXRequest(connection_pool_size=32, http_version="2", connect_timeout=5, read_timeout=30))
+        # get_updates adds the long-poll timeout to read_timeout itself; this is only the slack.
+        .get_updates_request(HTTPXRequest(connection_pool_size=4, http_version="2", read_timeout=5))
+        # Updates drained by stop() after the app stops running buffer text without a
+        # tracked flush task; send it before shutdown closes the HTTP client.
+        .post_stop(lambda app: buffer.flush_all(app.bot))
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", help_handler))
     application.add_handler(CommandHandler("help", help_handler))
     application.add_handler(
-        CommandHandler(
-            "create_project",
-            lambda u, c: create_project_handler(u, c, config=config, repo=repo),
-        )
+        CommandHandler("create_project", partial(create_project_handler, config=config, repo=repo))
     )
     application.add_handler(
-        CommandHandler(
-            "bind_customer",
-            lambda u, c: bind_customer_handler(u, c, config=config, repo=repo),
-        )
+        CommandHandler("bind_customer", partial(bind_customer_handler, config=config, repo=repo))
     )
+    application.add_handler(CommandHandler("project_info", partial(project_info_handler, repo=repo)))
     application.add_handler(
-        CommandHandler(
-            "project_info", lambda u, c: project_info_handler(u, c, repo=repo)
-        )
+        CommandHandler("list_projects", partial(list_projects_handler, config=config, repo=repo))
     )
     application.add_handler(
-        CommandHandler("list_projects", lambda u, c: list_projects_handler(u, c, config, repo))
-    )
-    application.add_handler(
-        CommandHandler(
-            "unlink_project",
-            lambda u, c: unlink_project_handler(u, c, config=config, repo=repo),
-        )
+        CommandHandler("unlink_project", partial(unlink_project_handler, config=config, repo=repo))
     )
 
     application.add_handler(
-        MessageHandler(~filters.COMMAND & filters.ALL, lambda u, c: relay_message(u, c, repo=repo))
+        MessageHandler(RELAY_FILTER, partial(relay_message, repo=repo, buffer=buffer))
     )
     application.add_error_handler(on_error)
     return application
@@ -262,9 +394,32 @@ def main() -> None:
     logger.info("Starting bot with admin %s", config.admin_user_id)
     repo = SQLiteProjectRepository(config.db_path)
 
+    try:
+        import uvloop
+    except ImportError:
+        pass
+    else:
+        uvloop.install()
+
     app = build_application(config, repo)
-    # Long polling startup for Railway or any host without webhooks.
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    if config.use_webhook:
+        # Telegram pushes updates to PUBLIC_URL/<token>; no idle polling traffic.
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=config.port,
+            url_path=config.bot_token,
+            webhook_url=f"{config.public_url}/{config.bot_token}",
+            allowed_updates=[Update.MESSAGE],
+        )
+        return
+    # Long polling fallback for any host without a public HTTPS endpoint.
+    # Telegram holds each getUpdates open for up to POLLING_TIMEOUT seconds.
+    app.run_polling(
+        timeout=POLLING_TIMEOUT,
+        poll_interval=0.0,
+        bootstrap_retries=-1,
+        allowed_updates=[Update.MESSAGE],
+    )
 
 
 if __name__ == "__main__":
@@ -1,9 +1,16 @@
 """Storage layer for project chat bindings."""
 from __future__ import annotations
 
+from collections import OrderedDict
 from dataclasses import dataclass
 from typing import List, Optional, Tuple
 import sqlite3
+import threading
+
+CHAT_CACHE_SIZE = 4096
+
+# Returned by cached_chat when the answer is not known without querying the DB.
+CACHE_MISS = object()
 
 
 @dataclass
@@ -27,6 +34,10 @@ class ProjectRepository:
     def find_by_chat_id(self, chat_id: int) -> Optional[Tuple[Project, str]]:
         raise NotImplementedError
 
+    def cached_chat(self, chat_id: int):
+        """Return a memoised find_by_chat_id result without blocking, or CACHE_MISS."""
+        return CACHE_MISS
+
     def list_projects(self) -> List[Project]:
         raise NotImplementedError
 
@@ -35,16 +46,52 @@ class ProjectRepository:
 
 
 class SQLiteProjectRepository(ProjectRepository):
+    # Fixed statement texts so sqlite3's per-connection statement cache always hits.
+    _COLUMNS = "slug, customer_chat_id, executor_chat_id, is_active"
+    _SQL_FIND_BY_SLUG = f"SELECT {_COLUMNS} FROM projects WHERE slug = ?"
+    # UNION ALL instead of OR so each branch can use its own index.
+    _SQL_FIND_BY_CHAT = (
+        f"SELECT {_COLUMNS} FROM projects WHERE customer_chat_id = ? "
+        "UNION ALL "
+        f"SELECT {_COLUMNS} FROM projects WHERE executor_chat_id = ? "
+        "LIMIT 1"
+    )
+    _SQL_LIST = f"SELECT {_COLUMNS} FROM projects ORDER BY slug"
+    _SQL_INSERT = (
+        "INSERT INTO projects (slug, customer_chat_id, executor_chat_id, is_active) VALUES (?, NULL, ?, 1) "
+        f"ON CONFLICT(slug) DO NOTHING RETURNING {_COLUMNS}"
+    )
+    _SQL_BIND_CUSTOMER = (
+        f"UPDATE projects SET customer_chat_id = ?, is_active = 1 WHERE slug = ? RETURNING {_COLUMNS}"
+    )
+    _SQL_UNLINK = (
+        "UPDATE projects SET "
+        "customer_chat_id = CASE WHEN customer_chat_id = ? THEN NULL ELSE customer_chat_id END, "
+        "executor_chat_id = CASE WHEN executor_chat_id = ? THEN NULL ELSE executor_chat_id END, "
+        f"is_active = 0 WHERE slug = ? RETURNING {_COLUMNS}"
+    )
+
     def __init__(self, db_path: str) -> None:
         self.db_path = db_path
+        # One connection for the lifetime of the repository, in autocommit mode;
+        # every write is a single statement.
+        self._conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None, cached_statements=256
+        )
+        self._lock = threading.Lock()
+        # chat_id -> find_by_chat_id result, including None for unbound chats;
+        # writes evict the entries they affect.
+        self._chat_cache: OrderedDict[int, Optional[Tuple[Project, str]]] = OrderedDict()
         self._init_db()
 
-    def _get_conn(self) -> sqlite3.Connection:
-        return sqlite3.connect(self.db_path)
-
     def _init_db(self) -> None:
-        with self._get_conn() as conn:
-            conn.execute(
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA temp_store=MEMORY")
+            self._conn.execute("PRAGMA mmap_size=67108864")
+            self._conn.execute("PRAGMA cache_size=-16000")
+            self._conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS projects (
                     slug TEXT PRIMARY KEY,
@@ -54,7 +101,28 @@ class SQLiteProjectRepository(ProjectRepository):
                 )
                 """
             )
-            conn.commit()
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_projects_customer ON projects(customer_chat_id) "
+                "WHERE customer_chat_id IS NOT NULL"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_projects_executor ON projects(executor_chat_id) "
+                "WHERE executor_chat_id IS NOT NULL"
+            )
+
+    def _write_returning(self, sql: str, params: tuple, slug: str, chat_id: int) -> Optional[Project]:
+        with self._lock:
+            # fetchall steps the statement to completion so the autocommit write lands.
+            rows = self._conn.execute(sql, params).fetchall()
+            self._invalidate(slug, chat_id)
+        return self._row_to_project(rows[0]) if rows else None
+
+    def _invalidate(self, slug: str, chat_id: int) -> None:
+        """Drop cached lookups for chat_id and for every chat bound to project slug."""
+        self._chat_cache.pop(chat_id, None)
+        stale = [key for key, found in self._chat_cache.items() if found and found[0].slug == slug]
+        for key in stale:
+            del self._chat_cache[key]
 
     def _row_to_project(self, row) -> Project:
         return Project(
@@ -65,77 +133,59 @@ class SQLiteProjectRepository(ProjectRepository):
         )
 
     def create_project(self, slug: str, executor_chat_id: int) -> Project:
-        with self._get_conn() as conn:
-            cur = conn.execute("SELECT slug FROM projects WHERE slug = ?", (slug,))
-            if cur.fetchone():
-                raise ValueError("Project already exists")
-            conn.execute(
-                "INSERT INTO projects (slug, customer_chat_id, executor_chat_id, is_active) VALUES (?, NULL, ?, 1)",
-                (slug, executor_chat_id),
-            )
-            conn.commit()
-        return Project(slug=slug, customer_chat_id=None, executor_chat_id=executor_chat_id, is_active=True)
+        project = self._write_returning(
+            self._SQL_INSERT, (slug, executor_chat_id), slug, executor_chat_id
+        )
+        if not project:
+            raise ValueError("Project already exists")
+        return project
 
     def bind_customer_chat(self, slug: str, chat_id: int) -> Project:
-        project = self.find_by_slug(slug)
+        project = self._write_returning(self._SQL_BIND_CUSTOMER, (chat_id, slug), slug, chat_id)
         if not project:
             raise ValueError("Project not found")
-        with self._get_conn() as conn:
-            conn.execute(
-                "UPDATE projects SET customer_chat_id = ?, is_active = 1 WHERE slug = ?",
-                (chat_id, slug),
-            )
-            conn.commit()
-        project.customer_chat_id = chat_id
-        project.is_active = True
         return project
 
     def find_by_slug(self, slug: str) -> Optional[Project]:
-        with self._get_conn() as conn:
-            cur = conn.execute(
-                "SELECT slug, customer_chat_id, executor_chat_id, is_active FROM projects WHERE slug = ?",
-                (slug,),
-            )
+        with self._lock:
+            cur = self._conn.execute(self._SQL_FIND_BY_SLUG, (slug,))
             row = cur.fetchone()
-            return self._row_to_project(row) if row else None
+        return self._row_to_project(row) if row else None
+
+    def cached_chat(self, chat_id: int):
+        # Lock-free single dict read, safe to call from the event loop. Recency is
+        # not refreshed here, so hot chats may occasionally be re-fetched.
+        return self._chat_cache.get(chat_id, CACHE_MISS)
 
     def find_by_chat_id(self, chat_id: int) -> Optional[Tuple[Project, str]]:
-        with self._get_conn() as conn:
-            cur = conn.execute(
-                "SELECT slug, customer_chat_id, executor_chat_id, is_active FROM projects WHERE customer_chat_id = ? OR executor_chat_id = ?",
-                (chat_id, chat_id),
-            )
+        with self._lock:
+            try:
+                found = self._chat_cache[chat_id]
+            except KeyError:
+                pass
+            else:
+                self._chat_cache.move_to_end(chat_id)
+                return found
+            cur = self._conn.execute(self._SQL_FIND_BY_CHAT, (chat_id, chat_id))
             row = cur.fetchone()
-            if not row:
-                return None
-            project = self._row_to_project(row)
-            role = "customer" if project.customer_chat_id == chat_id else "executor"
-            return project, role
+            if row:
+                project = self._row_to_project(row)
+                role = "customer" if project.customer_chat_id == chat_id else "executor"
+                found = (project, role)
+            else:
+                found = None
+            self._chat_cache[chat_id] = found
+            if len(self._chat_cache) > CHAT_CACHE_SIZE:
+                self._chat_cache.popitem(last=False)
+        return found
 
     def list_projects(self) -> List[Project]:
-        with self._get_conn() as conn:
-            cur = conn.execute(
-                "SELECT slug, customer_chat_id, executor_chat_id, is_active FROM projects ORDER BY slug"
-            )
-            return [self._row_to_project(row) for row in cur.fetchall()]
+        with self._lock:
+            # Build projects straight off the cursor; no intermediate row list.
+            return [self._row_to_project(row) for row in self._conn.execute(self._SQL_LIST)]
 
     def unlink_chat(self, slug: str, chat_id: int) -> Project:
-        project = self.find_by_slug(slug)
+        project = self._write_returning(self._SQL_UNLINK, (chat_id, chat_id, slug), slug, chat_id)
         if not project:
             raise ValueError("Project not found")
-        new_customer = project.customer_chat_id
-        new_executor = project.executor_chat_id
-        if chat_id == project.customer_chat_id:
-            new_customer = None
-        if chat_id == project.executor_chat_id:
-            new_executor = None
-        with self._get_conn() as conn:
-            conn.execute(
-                "UPDATE projects SET customer_chat_id = ?, executor_chat_id = ?, is_active = 0 WHERE slug = ?",
-                (new_customer, new_executor, slug),
-            )
-            conn.commit()
-        project.customer_chat_id = new_customer
-        project.executor_chat_id = new_executor
-        project.is_active = False
         return project